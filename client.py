@@ -1,11 +1,20 @@
 import os
+import asyncio
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from bisect import bisect_left
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
-from typing import Optional
-import threading
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from functools import lru_cache
+from typing import Awaitable, Callable, Optional
 
 import aiosqlite
 import discord
+from aiohttp import web
 from discord import app_commands
 from discord.ext import commands, tasks
 from discord.app_commands import AppCommandError, CheckFailure
@@ -22,15 +31,84 @@ INTENTS.message_content = True
 
 BOT_PREFIX = "!"
 DB_PATH = "players.db"
+SYNC_HASH_PATH = ".sync_hash"  # empreinte des commandes au dernier sync (FORCE_SYNC=1 pour forcer)
 
 TEST_GUILD_ID = 1282628230108418048
 LEAD_ROLE_ID = 1282641140750880779
 
+# Journal des erreurs : le formatage (tracebacks) et l'écriture sur stderr se font dans le
+# thread du QueueListener, la boucle asyncio ne fait qu'empiler l'enregistrement.
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    # File en mémoire, même process : inutile de pré-formater comme le fait prepare()
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+logger = logging.getLogger("bot")
+logger.setLevel(logging.INFO)
+logger.propagate = False  # discord.py installe son propre handler sur le logger racine
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+logger.addHandler(_LazyQueueHandler(_log_queue))
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("[{asctime}] [{levelname}] {name}: {message}", style="{"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+_log_listener.start()
+_log_listener_running = True
+
+# Textes et formats partagés par les commandes
+MSG_GUILD_ONLY = "❌ À utiliser dans un serveur."
+MSG_LEAD_ONLY = "⛔ Commande réservée aux **Leads**."
+MSG_NOT_LISTED = "❌ Ce nom n'est pas dans la liste. Ajoute-le d'abord avec `/add name:<nom>`."
+# Gabarits remplis via str.format(name=..., date=...)
+MSG_NOTES_DELETED = "🗑️ Notes supprimées pour **{name}**."
+MSG_NO_NOTES = "ℹ️ Aucune note à supprimer pour **{name}**."
+MSG_TRIAL_REMINDER = "🔔 **{name}** n'est plus en période d’essai (14 jours écoulés depuis {date})."
+TS_FMT = "%Y-%m-%d %H:%M"
+
 class MyBot(commands.Bot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Connexion SQLite partagée (ouverte dans setup_hook) + verrou d'écriture
+        self.db: Optional[aiosqlite.Connection] = None
+        self.db_lock = asyncio.Lock()
+        self.keepalive: Optional[web.AppRunner] = None
+
     async def setup_hook(self):
+        if os.getenv("PORT"):
+            self.keepalive = await start_keepalive_server(int(os.getenv("PORT")))
+        self.db = await open_db()
+        await init_db(self.db)
         test_guild = discord.Object(id=TEST_GUILD_ID)
+        # Sync seulement si les commandes ont changé depuis le dernier démarrage
+        payload = [c.to_dict(self.tree) for c in self.tree.get_commands(guild=test_guild)]
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        try:
+            with open(SYNC_HASH_PATH, encoding="utf-8") as f:
+                previous = f.read().strip()
+        except OSError:
+            previous = ""
+        if digest == previous and not os.getenv("FORCE_SYNC"):
+            logger.info("🧪 Commandes inchangées, sync ignoré")
+            return
         synced = await self.tree.sync(guild=test_guild)
-        print(f"🧪 Synced {len(synced)} cmds to test guild")
+        with open(SYNC_HASH_PATH, "w", encoding="utf-8") as f:
+            f.write(digest)
+        logger.info("🧪 Synced %d cmds to test guild", len(synced))
+
+    async def close(self):
+        await super().close()
+        if self.db is not None:
+            async with self.db_lock:
+                await self.db.execute(SQL_OPTIMIZE)
+            await self.db.close()
+            self.db = None
+        if self.keepalive is not None:
+            await self.keepalive.cleanup()
+            self.keepalive = None
+        # close() peut être appelé deux fois (signal puis fin de run()) : stop() n'est pas idempotent
+        global _log_listener_running
+        if _log_listener_running:
+            _log_listener.stop()
+            _log_listener_running = False
 
 bot = MyBot(command_prefix=BOT_PREFIX, intents=INTENTS, help_command=None)
 
@@ -72,78 +150,313 @@ CREATE TABLE IF NOT EXISTS player_notes_external (
 );
 """
 
-async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(CREATE_TABLE_SETTINGS)
-        await db.execute(CREATE_TABLE_PLAYERS_EXTERNAL)
-        await db.execute(CREATE_TABLE_NOTES_EXTERNAL)
-        await db.commit()
+# Index partiel et couvrant : seuls les essais pas encore notifiés y figurent, triés par
+# échéance pour la requête globale du trial_checker (plage trial_end_utc <= now, sans
+# lecture de la table ; notified_done est répété en fin de clé pour que SQLite la juge
+# couvrante).
+CREATE_INDEX_PLAYERS_EXTERNAL_DUE = """
+CREATE INDEX IF NOT EXISTS idx_players_external_due
+ON players_external (trial_end_utc, guild_id, name, added_at_utc, notified_done)
+WHERE notified_done = 0;
+"""
+
+# Parcours couvrant (guild_id, name) de SQL_NAMES_EXTERNAL : charge les noms du cache de
+# l'autocomplete sans lire la table (la collation NOCASE ne sert plus, le tri se fait en Python)
+CREATE_INDEX_PLAYERS_EXTERNAL_NAME = """
+CREATE INDEX IF NOT EXISTS idx_players_external_guild_name
+ON players_external (guild_id, name COLLATE NOCASE);
+"""
+
+CREATE_INDEX_PLAYERS_EXTERNAL_ADDED = """
+CREATE INDEX IF NOT EXISTS idx_players_external_added
+ON players_external (guild_id, added_at_utc, trial_end_utc);
+"""
+
+# Schéma complet, idempotent, exécuté d'un bloc au démarrage
+SCHEMA_DDL = (
+    CREATE_TABLE_SETTINGS
+    + CREATE_TABLE_PLAYERS_EXTERNAL
+    + CREATE_TABLE_NOTES_EXTERNAL
+    + CREATE_INDEX_PLAYERS_EXTERNAL_DUE
+    + CREATE_INDEX_PLAYERS_EXTERNAL_ADDED
+    + CREATE_INDEX_PLAYERS_EXTERNAL_NAME
+)
+
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-64000;",      # ~64 Mo de cache de pages
+    "PRAGMA mmap_size=268435456;",    # 256 Mo
+    "PRAGMA busy_timeout=5000;",
+)
+# Cache des requêtes préparées de sqlite3 : marge pour les SQL_* + les variantes IN (...)
+DB_CACHED_STATEMENTS = 256
+
+# ---------- SQL ----------
+# Textes constants : la connexion partagée garde les requêtes préparées dans son cache
+SQL_OPTIMIZE = "PRAGMA optimize;"
+
+SQL_UPSERT_TRIAL_CHANNEL = (
+    "INSERT INTO guild_settings (guild_id, trial_channel_id) VALUES (?, ?) "
+    "ON CONFLICT(guild_id) DO UPDATE SET trial_channel_id=excluded.trial_channel_id"
+)
+
+SQL_GET_TRIAL_CHANNEL = "SELECT trial_channel_id FROM guild_settings WHERE guild_id=?"
+
+SQL_INSERT_PLAYER_EXTERNAL = (
+    "INSERT INTO players_external (guild_id, name, name_key, added_at_utc, trial_end_utc) "
+    "VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT(guild_id, name_key) DO NOTHING"
+)
+
+SQL_COUNT_EXTERNAL = (
+    "SELECT COUNT(*), COALESCE(SUM(trial_end_utc > ?), 0) FROM players_external WHERE guild_id=?"
+)
+
+# Durées calculées par SQLite (en secondes, relatives à :now) : pas de parse_iso côté Python
+SQL_PAGE_COLUMNS_EXTERNAL = (
+    "SELECT name, "
+    "CAST(strftime('%s', :now) AS INTEGER) - CAST(strftime('%s', added_at_utc) AS INTEGER), "
+    "CAST(strftime('%s', trial_end_utc) AS INTEGER) - CAST(strftime('%s', :now) AS INTEGER) "
+    "FROM players_external "
+)
+
+SQL_PAGE_IN_TRIAL_EXTERNAL = (
+    SQL_PAGE_COLUMNS_EXTERNAL
+    + "WHERE guild_id=:guild_id AND trial_end_utc > :now ORDER BY added_at_utc ASC LIMIT :limit OFFSET :offset"
+)
+
+SQL_PAGE_ENDED_EXTERNAL = (
+    SQL_PAGE_COLUMNS_EXTERNAL
+    + "WHERE guild_id=:guild_id AND trial_end_utc <= :now ORDER BY added_at_utc ASC LIMIT :limit OFFSET :offset"
+)
+
+# Tous serveurs confondus : une seule requête par tick, regroupée ensuite par guild_id.
+# Seuls les serveurs ayant un salon de rappels configuré : les autres ne peuvent rien recevoir.
+SQL_FETCH_DUE_EXTERNAL_ALL = (
+    "SELECT guild_id, name, added_at_utc, trial_end_utc FROM players_external "
+    "JOIN guild_settings USING (guild_id) "
+    "WHERE notified_done=0 AND trial_end_utc <= ? AND trial_channel_id IS NOT NULL"
+)
+
+# Prochaine échéance tous serveurs confondus, mêmes serveurs que SQL_FETCH_DUE_EXTERNAL_ALL :
+# un rappel en souffrance faute de salon ne doit pas bloquer l'échéance dans le passé
+SQL_NEXT_DUE_EXTERNAL = (
+    "SELECT MIN(trial_end_utc) FROM players_external "
+    "JOIN guild_settings USING (guild_id) "
+    "WHERE notified_done=0 AND trial_channel_id IS NOT NULL"
+)
+
+# {} : liste de placeholders "?, ?, ..." dimensionnée au lot
+SQL_MARK_NOTIFIED_EXTERNAL_IN = (
+    "UPDATE players_external SET notified_done=1, notified_at_utc=? "
+    "WHERE guild_id=? AND name_key IN ({})"
+)
+# Reste sous la limite de variables par requête des vieux SQLite (999) ; puissance de 2
+# pour que les tailles de lot arrondies (1, 2, 4, ... 512) tombent toutes dessous
+SQL_IN_BATCH_SIZE = 512
+
+# Upsert conditionné à l'existence du joueur : pas de SELECT préalable, et pas de notes
+# orphelines si l'entrée a été retirée entre l'ouverture du formulaire et l'enregistrement
+SQL_UPSERT_NOTES_EXTERNAL = (
+    "INSERT INTO player_notes_external (guild_id, name_key, name, characters_level, prev_guild_alliance, optimized, "
+    "content_preference, objectives, age, contribution, updated_at_utc) "
+    "SELECT :guild_id, :name_key, :name, :characters_level, :prev_guild_alliance, :optimized, "
+    ":content_preference, :objectives, :age, :contribution, :now "
+    "WHERE EXISTS (SELECT 1 FROM players_external WHERE guild_id=:guild_id AND name_key=:name_key) "
+    "ON CONFLICT(guild_id, name_key) DO UPDATE SET "
+    "name=excluded.name, "
+    "characters_level=excluded.characters_level, "
+    "prev_guild_alliance=excluded.prev_guild_alliance, "
+    "optimized=excluded.optimized, "
+    "content_preference=excluded.content_preference, "
+    "objectives=excluded.objectives, "
+    "age=excluded.age, "
+    "contribution=excluded.contribution, "
+    "updated_at_utc=excluded.updated_at_utc"
+)
+
+SQL_GET_NOTES_EXTERNAL = (
+    "SELECT name, characters_level, prev_guild_alliance, optimized, content_preference, "
+    "objectives, age, contribution, updated_at_utc "
+    "FROM player_notes_external WHERE guild_id=? AND name_key=?"
+)
+
+SQL_DELETE_NOTES_EXTERNAL = "DELETE FROM player_notes_external WHERE guild_id=? AND name_key=?"
+
+SQL_DELETE_PLAYER_EXTERNAL = "DELETE FROM players_external WHERE guild_id=? AND name_key=?"
+
+SQL_EXISTS_PLAYER_EXTERNAL = "SELECT 1 FROM players_external WHERE guild_id=? AND name_key=?"
+
+SQL_NAMES_EXTERNAL = "SELECT name FROM players_external WHERE guild_id=?"
+
+SQL_GET_TRIAL_EXTERNAL = "SELECT added_at_utc, trial_end_utc FROM players_external WHERE guild_id=? AND name_key=?"
+
+async def open_db() -> aiosqlite.Connection:
+    # Fabrique de connexion : les PRAGMA (hors journal_mode) ne valent que pour la connexion
+    db = await aiosqlite.connect(DB_PATH, cached_statements=DB_CACHED_STATEMENTS)
+    for pragma in DB_PRAGMAS:
+        await db.execute(pragma)
+    return db
+
+async def init_db(db: aiosqlite.Connection):
+    await db.executescript(SCHEMA_DDL)
+    await db.execute(SQL_OPTIMIZE)
 
 # ---------- DB Ops (EXTERNAL ONLY) ----------
+# Cache du salon des rappels : guild_id -> (channel_id, instant de lecture monotonic).
+# Mis à jour à l'écriture ; le TTL ne sert qu'à voir passer une modif faite hors du bot.
+TRIAL_CHANNEL_CACHE_TTL = 3600.0
+_trial_channel_cache: dict[int, tuple[Optional[int], float]] = {}
+
 async def set_trial_channel(guild_id: int, channel_id: Optional[int]):
-    async with aiosqlite.connect(DB_PATH) as db:
+    db = bot.db
+    async with bot.db_lock:
         await db.execute(
-            "INSERT INTO guild_settings (guild_id, trial_channel_id) VALUES (?, ?) "
-            "ON CONFLICT(guild_id) DO UPDATE SET trial_channel_id=excluded.trial_channel_id",
+            SQL_UPSERT_TRIAL_CHANNEL,
             (guild_id, channel_id),
         )
         await db.commit()
+    _trial_channel_cache[guild_id] = (channel_id or None, time.monotonic())
+    # Serveur (dés)activé pour les rappels : la prochaine échéance globale peut changer
+    invalidate_next_due()
 
 async def get_trial_channel_id(guild_id: int) -> Optional[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT trial_channel_id FROM guild_settings WHERE guild_id=?", (guild_id,)) as cur:
-            row = await cur.fetchone()
-            return row[0] if row and row[0] else None
-
+    cached = _trial_channel_cache.get(guild_id)
+    if cached and time.monotonic() - cached[1] < TRIAL_CHANNEL_CACHE_TTL:
+        return cached[0]
+    async with bot.db.execute(SQL_GET_TRIAL_CHANNEL, (guild_id,)) as cur:
+        row = await cur.fetchone()
+    channel_id = row[0] if row and row[0] else None
+    _trial_channel_cache[guild_id] = (channel_id, time.monotonic())
+    return channel_id
+
+# Noms pour l'autocomplete : guild_id -> (noms en minuscules triés, noms affichés dans le
+# même ordre, instant de lecture). Deux listes parallèles : la recherche par préfixe se fait
+# par bisect sur les minuscules, sans lower() ni parcours complet à chaque frappe.
+# Rechargé au besoin, invalidé à l'ajout / la suppression ; le TTL couvre les modifs hors bot.
+NAMES_CACHE_TTL = 300.0
+_names_cache: dict[int, tuple[list[str], list[str], float]] = {}
+
+async def get_external_names(guild_id: int) -> tuple[list[str], list[str]]:
+    cached = _names_cache.get(guild_id)
+    if cached and time.monotonic() - cached[2] < NAMES_CACHE_TTL:
+        return cached[0], cached[1]
+    async with bot.db.execute(SQL_NAMES_EXTERNAL, (guild_id,)) as cur:
+        entries = sorted((r[0].lower(), r[0]) for r in await cur.fetchall())
+    lowered = [low for low, _ in entries]
+    display = [name for _, name in entries]
+    _names_cache[guild_id] = (lowered, display, time.monotonic())
+    return lowered, display
+
+# Rendu de /list : guild_id -> (instant monotonic, now_iso, total, en essai, {page: description}).
+# Même instantané réutilisé ~30 s : les durées sont à la minute, rien ne bouge entre deux appels.
+LIST_CACHE_TTL = 30.0
+_list_cache: dict[int, tuple[float, str, int, int, dict[int, str]]] = {}
+
+def invalidate_player_caches(guild_id: int):
+    # Ajout / suppression d'une entrée : noms de l'autocomplete et rendu de /list à refaire
+    _names_cache.pop(guild_id, None)
+    _list_cache.pop(guild_id, None)
+
+# Les appelants passent le nom déjà strip() : une même saisie = une seule clé de cache
+@lru_cache(maxsize=2048)
 def _normalize_name(name: str) -> str:
     return " ".join(name.strip().split()).lower()
 
 async def add_player_by_name(guild_id: int, name: str) -> tuple[bool, str]:
+    name = name.strip()
     norm = _normalize_name(name)
     if not norm:
         return (False, "Nom invalide (vide).")
-    now_utc = datetime.now(timezone.utc)
+    now_utc = datetime.now(timezone.utc).replace(microsecond=0)
     trial_end = now_utc + timedelta(days=14)
-    async with aiosqlite.connect(DB_PATH) as db:
+    db = bot.db
+    async with bot.db_lock:
+        # Upsert atomique : pas de SELECT préalable, le doublon est détecté par la PK
         async with db.execute(
-            "SELECT 1 FROM players_external WHERE guild_id=? AND name_key=?",
-            (guild_id, norm),
+            SQL_INSERT_PLAYER_EXTERNAL,
+            (guild_id, name, norm, now_utc.isoformat(), trial_end.isoformat()),
         ) as cur:
-            if await cur.fetchone():
-                return (False, "Ce nom existe déjà dans la liste. Choisis un autre nom.")
-        await db.execute(
-            "INSERT INTO players_external (guild_id, name, name_key, added_at_utc, trial_end_utc) "
-            "VALUES (?, ?, ?, ?, ?)",
-            (guild_id, name.strip(), norm, now_utc.isoformat(), trial_end.isoformat()),
-        )
+            created = cur.rowcount > 0
         await db.commit()
+    if not created:
+        return (False, "Ce nom existe déjà dans la liste. Choisis un autre nom.")
+    invalidate_player_caches(guild_id)
+    invalidate_next_due()
     return (True, "Entrée ajoutée avec succès.")
 
-async def fetch_all_external_players(guild_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT name, added_at_utc, trial_end_utc FROM players_external WHERE guild_id=? ORDER BY added_at_utc ASC",
-            (guild_id,),
-        ) as cur:
-            return await cur.fetchall()
-
-async def fetch_due_trials_external(guild_id: int):
-    now_iso = datetime.now(timezone.utc).isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT name, added_at_utc, trial_end_utc FROM players_external "
-            "WHERE guild_id=? AND notified_done=0 AND trial_end_utc <= ?",
-            (guild_id, now_iso),
-        ) as cur:
-            return await cur.fetchall()
-
-async def mark_notified_external(guild_id: int, name_key: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE players_external SET notified_done=1, notified_at_utc=? "
-            "WHERE guild_id=? AND name_key=?",
-            (datetime.now(timezone.utc).isoformat(), guild_id, name_key),
-        )
+async def count_external_players(guild_id: int, now_iso: str) -> tuple[int, int]:
+    # (total, dont en période d'essai)
+    async with bot.db.execute(SQL_COUNT_EXTERNAL, (now_iso, guild_id)) as cur:
+        total, in_trial = await cur.fetchone()
+    return total, in_trial
+
+async def fetch_external_players_page(guild_id: int, now_iso: str, in_trial_count: int, offset: int, limit: int):
+    # Ordre d'affichage : essais en cours puis terminés, chacun par date d'ajout.
+    # Renvoie des tuples (name, secondes depuis l'ajout, secondes restantes, en_essai).
+    rows = []
+    params = {"guild_id": guild_id, "now": now_iso, "limit": limit, "offset": offset}
+    if offset < in_trial_count:
+        async with bot.db.execute(SQL_PAGE_IN_TRIAL_EXTERNAL, params) as cur:
+            rows = [(*r, True) for r in await cur.fetchall()]
+    if len(rows) < limit:
+        params["limit"] = limit - len(rows)
+        params["offset"] = max(0, offset - in_trial_count)
+        async with bot.db.execute(SQL_PAGE_ENDED_EXTERNAL, params) as cur:
+            rows += [(*r, False) for r in await cur.fetchall()]
+    return rows
+
+# Prochaine échéance connue (None = aucun essai en attente). Relue une fois par réveil du
+# trial_checker (MIN sur l'index) : tant qu'elle n'est pas atteinte, rien d'autre n'est lu.
+_next_due_iso: Optional[str] = None
+_next_due_known = False
+
+def invalidate_next_due():
+    global _next_due_known
+    _next_due_known = False
+
+async def get_next_due_external() -> Optional[str]:
+    global _next_due_iso, _next_due_known
+    if not _next_due_known:
+        async with bot.db.execute(SQL_NEXT_DUE_EXTERNAL) as cur:
+            row = await cur.fetchone()
+        _next_due_iso, _next_due_known = row[0], True
+    return _next_due_iso
+
+async def fetch_due_trials_external_all() -> dict[int, list[tuple[str, str, str]]]:
+    now_iso = _now_iso()
+    next_due = await get_next_due_external()
+    if next_due is None or now_iso < next_due:
+        return {}
+
+    due_by_guild: dict[int, list[tuple[str, str, str]]] = defaultdict(list)
+    async with bot.db.execute(SQL_FETCH_DUE_EXTERNAL_ALL, (now_iso,)) as cur:
+        async for guild_id, name, added_iso, trial_end_iso in cur:
+            due_by_guild[guild_id].append((name, added_iso, trial_end_iso))
+    # Les lignes lues vont être notifiées : l'échéance suivante sera relue au prochain tick
+    invalidate_next_due()
+    return due_by_guild
+
+@lru_cache(maxsize=None)
+def _sql_mark_notified_in(size: int) -> str:
+    return SQL_MARK_NOTIFIED_EXTERNAL_IN.format(", ".join("?" * size))
+
+async def mark_notified_external_bulk(guild_id: int, name_keys: list[str]):
+    if not name_keys:
+        return
+    now_iso = _now_iso()
+    db = bot.db
+    async with bot.db_lock:
+        # Un UPDATE ... IN (...) par lot, une seule transaction (donc un seul commit)
+        for i in range(0, len(name_keys), SQL_IN_BATCH_SIZE):
+            batch = name_keys[i:i + SQL_IN_BATCH_SIZE]
+            # Lot complété (doublons sans effet) jusqu'à la puissance de 2 suivante :
+            # quelques textes SQL seulement, donc réutilisés par le cache de requêtes
+            size = 1 << (len(batch) - 1).bit_length()
+            batch += [batch[-1]] * (size - len(batch))
+            await db.execute(_sql_mark_notified_in(size), (now_iso, guild_id, *batch))
         await db.commit()
 
 # ---- Notes EXTERNAL ----
@@ -158,202 +471,171 @@ async def upsert_notes_external(
     objectives: str,
     age: str,
     contribution: str,
-):
-    now_iso = datetime.now(timezone.utc).isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO player_notes_external (guild_id, name_key, name, characters_level, prev_guild_alliance, optimized, "
-            "content_preference, objectives, age, contribution, updated_at_utc) "
-            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
-            "ON CONFLICT(guild_id, name_key) DO UPDATE SET "
-            "name=excluded.name, "
-            "characters_level=excluded.characters_level, "
-            "prev_guild_alliance=excluded.prev_guild_alliance, "
-            "optimized=excluded.optimized, "
-            "content_preference=excluded.content_preference, "
-            "objectives=excluded.objectives, "
-            "age=excluded.age, "
-            "contribution=excluded.contribution, "
-            "updated_at_utc=excluded.updated_at_utc",
-            (
-                guild_id, name_key, name_display,
-                characters_level, prev_guild_alliance, optimized,
-                content_preference, objectives, age, contribution,
-                now_iso,
-            ),
-        )
-        await db.commit()
-
-async def update_optional_notes_external(guild_id: int, name_key: str, age: str, contribution: str):
-    now_iso = datetime.now(timezone.utc).isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE player_notes_external SET age=?, contribution=?, updated_at_utc=? "
-            "WHERE guild_id=? AND name_key=?",
-            (age, contribution, now_iso, guild_id, name_key),
-        )
+) -> bool:
+    now_iso = _now_iso()
+    db = bot.db
+    async with bot.db_lock:
+        async with db.execute(
+            SQL_UPSERT_NOTES_EXTERNAL,
+            {
+                "guild_id": guild_id, "name_key": name_key, "name": name_display,
+                "characters_level": characters_level, "prev_guild_alliance": prev_guild_alliance,
+                "optimized": optimized, "content_preference": content_preference,
+                "objectives": objectives, "age": age, "contribution": contribution,
+                "now": now_iso,
+            },
+        ) as cur:
+            saved = cur.rowcount > 0
         await db.commit()
+    return saved
 
 async def get_notes_external(guild_id: int, name_key: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT name, characters_level, prev_guild_alliance, optimized, content_preference, "
-            "objectives, age, contribution, updated_at_utc "
-            "FROM player_notes_external WHERE guild_id=? AND name_key=?",
-            (guild_id, name_key),
-        ) as cur:
-            return await cur.fetchone()
+    async with bot.db.execute(
+        SQL_GET_NOTES_EXTERNAL,
+        (guild_id, name_key),
+    ) as cur:
+        return await cur.fetchone()
 
 async def delete_notes_external(guild_id: int, name_key: str) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "DELETE FROM player_notes_external WHERE guild_id=? AND name_key=?",
+    db = bot.db
+    async with bot.db_lock:
+        async with db.execute(
+            SQL_DELETE_NOTES_EXTERNAL,
             (guild_id, name_key),
-        )
-        changes = db.total_changes
+        ) as cur:
+            changes = cur.rowcount
         await db.commit()
     return changes
 
 # ---------- Utils ----------
 def humanize_timedelta(delta: timedelta) -> str:
-    total_seconds = int(abs(delta.total_seconds()))
-    minutes, _ = divmod(total_seconds, 60)
-    hours, minutes = divmod(minutes, 60)
-    days, hours = divmod(hours, 24)
-    parts = []
-    if days: parts.append(f"{days}j")
-    if hours: parts.append(f"{hours}h")
-    if minutes and not days: parts.append(f"{minutes}m")
-    if not parts: parts.append("0m")
-    return " ".join(parts)
+    return humanize_seconds(int(delta.total_seconds()))
+
+def humanize_seconds(seconds: int) -> str:
+    # Résolution à la minute : le rendu est mis en cache par nombre de minutes
+    return _humanize_minutes(abs(seconds) // 60)
+
+@lru_cache(maxsize=4096)
+def _humanize_minutes(total_minutes: int) -> str:
+    days, rest = divmod(total_minutes, 1440)
+    hours, minutes = divmod(rest, 60)
+    # Deux unités au plus : jours + heures, sinon heures + minutes
+    if days:
+        return f"{days}j {hours}h" if hours else f"{days}j"
+    if hours:
+        return f"{hours}h {minutes}m" if minutes else f"{hours}h"
+    return f"{minutes}m"
+
+# Horodatage ISO mis en cache ~0,5 s : évite de reconstruire un datetime aware à chaque écriture
+_cached_iso = ""
+_cached_mono = float("-inf")
+
+def _now_iso() -> str:
+    global _cached_iso, _cached_mono
+    mono = time.monotonic()
+    if mono - _cached_mono > 0.5:
+        _cached_iso = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+        _cached_mono = mono
+    return _cached_iso
 
 def parse_iso(s: str) -> datetime:
+    # Tout est écrit en UTC aware (+00:00) : pas de conversion astimezone nécessaire
     dt = datetime.fromisoformat(s)
     if dt.tzinfo is None:
         dt = dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(timezone.utc)
+    return dt
 
-def _status_and_delta(added_iso: str, end_iso: str) -> tuple[str, str]:
-    added = parse_iso(added_iso)
-    end = parse_iso(end_iso)
-    now = datetime.now(timezone.utc)
-    if end > now:
+def _status_and_delta(in_trial: bool, since_s: int, remaining_s: int) -> tuple[str, str]:
+    if in_trial:
         status = "🟡 En essai"
-        remaining = humanize_timedelta(end - now)
-        delta = f"reste {remaining}"
+        delta = f"reste {humanize_seconds(remaining_s)}"
     else:
         status = "✅ Terminé"
-        ended_for = humanize_timedelta(now - end)
-        delta = f"terminé depuis {ended_for}"
-    since = humanize_timedelta(now - added)
+        delta = f"terminé depuis {humanize_seconds(remaining_s)}"
+    since = humanize_seconds(since_s)
     return status, f"ajouté il y a {since}, {delta}"
 
-def _chunk(lst, n):
-    for i in range(0, len(lst), n):
-        yield lst[i:i+n]
-
 def lead_only():
-    async def predicate(inter: discord.Interaction) -> bool:
+    # Prédicat synchrone (aucun await) : app_commands.check l'appelle sans créer de coroutine
+    def predicate(inter: discord.Interaction) -> bool:
         if inter.guild is None or not isinstance(inter.user, discord.Member):
             return False
-        return any(r.id == LEAD_ROLE_ID for r in inter.user.roles)
+        # get_role : recherche dichotomique dans les IDs de rôles du membre, sans construire la liste
+        return inter.user.get_role(LEAD_ROLE_ID) is not None
     return app_commands.check(predicate)
 
-def start_keepalive_server():
-    class Handler(BaseHTTPRequestHandler):
-        def do_GET(self):
-            self.send_response(200)
-            self.send_header("Content-Type", "text/plain; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(b"Bot is up")
-        def log_message(self, format, *args):
-            return
-    port = int(os.getenv("PORT", "8080"))
-    srv = HTTPServer(("0.0.0.0", port), Handler)
-    threading.Thread(target=srv.serve_forever, daemon=True).start()
+async def start_keepalive_server(port: int) -> web.AppRunner:
+    # Serveur aiohttp sur la boucle du bot : pas de thread, réponse vide (204) sur tout chemin
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(status=204)
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", health)  # add_get répond aussi à HEAD
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    return runner
 
 # ---------- UI: External Modals / Views ----------
+# Champs des modales : (attribut, label, placeholder, style, requis, longueur max).
+# Les TextInput doivent être recréés par instance (discord.py les rattache à la modale).
+NOTES_FIELDS = (
+    ("characters_level", "Combien de perso / LVL", "Ex: 3 persos / 200, 199, 180...",
+     discord.TextStyle.short, True, 200),
+    ("prev_guild_alliance", "Ancienne guilde / alliance", "Ex: Guilde X / Alliance Y",
+     discord.TextStyle.short, False, 200),
+    ("optimized", "Opti ou pas", "Ex: Opti PvP, opti PvM, en cours...",
+     discord.TextStyle.short, False, 200),
+    ("content_preference", "Préférence de contenu (PvP ou PvM)", "Ex: Koli, AvA, donjons...",
+     discord.TextStyle.short, True, 200),
+    ("objectives", "Objectifs / projets à venir", "Ex: Monter team, AvA régulier, succès...",
+     discord.TextStyle.paragraph, True, 1000),
+)
+
+OPTIONAL_NOTES_FIELDS = (
+    ("age", "Âge (optionnel)", "Ex: 23",
+     discord.TextStyle.short, False, 10),
+    ("contribution", "Apport à la guilde (optionnel)", "Ex: orga events, crafts, coaching...",
+     discord.TextStyle.paragraph, False, 1000),
+)
+
+def _build_text_inputs(modal: discord.ui.Modal, fields):
+    for attr, label, placeholder, style, required, max_length in fields:
+        item = discord.ui.TextInput(
+            label=label, placeholder=placeholder, style=style,
+            required=required, max_length=max_length,
+        )
+        setattr(modal, attr, item)
+        modal.add_item(item)
+
 class PlayerNotesModalExternal(discord.ui.Modal, title="Notes (sans mention)"):
     def __init__(self, guild_id: int, name_display: str):
         super().__init__(timeout=300)
         self.guild_id = guild_id
         self.name_display = name_display.strip()
-        self.name_key = _normalize_name(self.name_display)
-
-        self.characters_level = discord.ui.TextInput(
-            label="Combien de perso / LVL",
-            placeholder="Ex: 3 persos / 200, 199, 180...",
-            style=discord.TextStyle.short,
-            required=True, max_length=200,
-        )
-        self.prev_guild_alliance = discord.ui.TextInput(
-            label="Ancienne guilde / alliance",
-            placeholder="Ex: Guilde X / Alliance Y",
-            style=discord.TextStyle.short,
-            required=False, max_length=200,
-        )
-        self.optimized = discord.ui.TextInput(
-            label="Opti ou pas",
-            placeholder="Ex: Opti PvP, opti PvM, en cours...",
-            style=discord.TextStyle.short,
-            required=False, max_length=200,
-        )
-        self.content_preference = discord.ui.TextInput(
-            label="Préférence de contenu (PvP ou PvM)",
-            placeholder="Ex: Koli, AvA, donjons...",
-            style=discord.TextStyle.short,
-            required=True, max_length=200,
-        )
-        self.objectives = discord.ui.TextInput(
-            label="Objectifs / projets à venir",
-            placeholder="Ex: Monter team, AvA régulier, succès...",
-            style=discord.TextStyle.paragraph,
-            required=True, max_length=1000,
-        )
-
-        self.add_item(self.characters_level)
-        self.add_item(self.prev_guild_alliance)
-        self.add_item(self.optimized)
-        self.add_item(self.content_preference)
-        self.add_item(self.objectives)
+        _build_text_inputs(self, NOTES_FIELDS)
 
     async def on_submit(self, interaction: discord.Interaction):
-        # Vérifier existence dans players_external
-        async with aiosqlite.connect(DB_PATH) as db:
-            async with db.execute(
-                "SELECT 1 FROM players_external WHERE guild_id=? AND name_key=?",
-                (self.guild_id, self.name_key),
-            ) as cur:
-                if not await cur.fetchone():
-                    await interaction.response.send_message(
-                        "❌ Ce nom n'est pas dans la liste. Ajoute-le d'abord avec `/add name:<nom>`.", ephemeral=True
-                    )
-                    return
-
-        await upsert_notes_external(
-            self.guild_id,
-            self.name_key,
-            self.name_display,
-            self.characters_level.value.strip(),
-            self.prev_guild_alliance.value.strip(),
-            self.optimized.value.strip(),
-            self.content_preference.value.strip(),
-            self.objectives.value.strip(),
-            age="",
-            contribution="",
-        )
-        view = OptionalNotesCTAViewExternal(self.guild_id, self.name_display)
+        # L'existence du nom est vérifiée par /note puis par l'upsert lui-même.
+        # L'écriture est différée : un seul upsert avec (ou sans) les infos optionnelles
+        notes = {attr: getattr(self, attr).value.strip() for attr, *_ in NOTES_FIELDS}
+        view = OptionalNotesCTAViewExternal(self.guild_id, self.name_display, notes)
         await interaction.response.send_message(
-            f"✅ Notes enregistrées pour **{self.name_display}**.\n"
-            "Ajouter les **infos optionnelles** (Âge, Apport) ?",
+            f"📝 Notes prêtes pour **{self.name_display}**.\n"
+            "Ajouter les **infos optionnelles** (Âge, Apport) avant d'enregistrer ?",
             view=view, ephemeral=True
         )
 
 class OptionalNotesCTAViewExternal(discord.ui.View):
-    def __init__(self, guild_id: int, name_display: str):
+    def __init__(self, guild_id: int, name_display: str, notes: dict[str, str]):
         super().__init__(timeout=180)
         self.guild_id = guild_id
         self.name_display = name_display.strip()
+        self.name_key = _normalize_name(self.name_display)
+        self.notes = notes
+
+    async def on_timeout(self):
+        # Aucun bouton utilisé : on enregistre sans les infos optionnelles
+        await upsert_notes_external(self.guild_id, self.name_key, self.name_display, **self.notes, age="", contribution="")
 
     @discord.ui.button(label="Ajouter infos optionnelles", style=discord.ButtonStyle.secondary)
     async def open_optional(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -363,35 +645,49 @@ class OptionalNotesCTAViewExternal(discord.ui.View):
                 "⛔ Permission **Gérer le serveur** requise.", ephemeral=True
             )
             return
-        await interaction.response.send_modal(OptionalNotesModalExternal(self.guild_id, self.name_display))
+        self.stop()  # la modale prend le relais pour l'écriture
+        await interaction.response.send_modal(
+            OptionalNotesModalExternal(self.guild_id, self.name_display, self.notes)
+        )
+
+    @discord.ui.button(label="Enregistrer sans", style=discord.ButtonStyle.primary)
+    async def save_without_optional(self, interaction: discord.Interaction, button: discord.ui.Button):
+        perms = interaction.user.guild_permissions if interaction.user and interaction.guild else None
+        if not perms or not perms.manage_guild:
+            await interaction.response.send_message(
+                "⛔ Permission **Gérer le serveur** requise.", ephemeral=True
+            )
+            return
+        self.stop()
+        saved = await upsert_notes_external(self.guild_id, self.name_key, self.name_display, **self.notes, age="", contribution="")
+        await interaction.response.edit_message(
+            content=f"✅ Notes enregistrées pour **{self.name_display}**." if saved else MSG_NOT_LISTED, view=None
+        )
 
 class OptionalNotesModalExternal(discord.ui.Modal, title="Infos optionnelles (sans mention)"):
-    def __init__(self, guild_id: int, name_display: str):
+    def __init__(self, guild_id: int, name_display: str, notes: dict[str, str]):
         super().__init__(timeout=300)
         self.guild_id = guild_id
         self.name_display = name_display.strip()
         self.name_key = _normalize_name(self.name_display)
+        self.notes = notes
+        _build_text_inputs(self, OPTIONAL_NOTES_FIELDS)
 
-        self.age = discord.ui.TextInput(
-            label="Âge (optionnel)",
-            placeholder="Ex: 23", style=discord.TextStyle.short,
-            required=False, max_length=10,
+    async def on_submit(self, interaction: discord.Interaction):
+        saved = await upsert_notes_external(
+            self.guild_id, self.name_key, self.name_display, **self.notes,
+            age=self.age.value.strip(), contribution=self.contribution.value.strip(),
         )
-        self.contribution = discord.ui.TextInput(
-            label="Apport à la guilde (optionnel)",
-            placeholder="Ex: orga events, crafts, coaching...",
-            style=discord.TextStyle.paragraph,
-            required=False, max_length=1000,
+        if not saved:
+            await interaction.response.send_message(MSG_NOT_LISTED, ephemeral=True)
+            return
+        await interaction.response.send_message(
+            f"✅ Notes et infos optionnelles enregistrées pour **{self.name_display}**.", ephemeral=True
         )
-        self.add_item(self.age)
-        self.add_item(self.contribution)
 
-    async def on_submit(self, interaction: discord.Interaction):
-        await update_optional_notes_external(
-            self.guild_id, self.name_key,
-            self.age.value.strip(), self.contribution.value.strip()
-        )
-        await interaction.response.send_message("✅ Infos optionnelles enregistrées.", ephemeral=True)
+    async def on_timeout(self):
+        # Modale fermée sans validation : on n'oublie pas les notes principales
+        await upsert_notes_external(self.guild_id, self.name_key, self.name_display, **self.notes, age="", contribution="")
 
 class NotesViewExternal(discord.ui.View):
     def __init__(self, guild_id: int, name_display: str):
@@ -414,23 +710,42 @@ class NotesViewExternal(discord.ui.View):
 # ---------- Events ----------
 @bot.event
 async def on_ready():
-    await init_db()
     print(f"Connecté en tant que {bot.user} (id={bot.user.id})")
     if not trial_checker.is_running():
         trial_checker.start()
+    if not db_optimizer.is_running():
+        db_optimizer.start()
     print("Prêt.")
 
+@bot.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    # Les overwrites du salon ont pu changer : on oublie le droit d'envoi mis en cache
+    _send_perm_cache.pop((after.guild.id, after.id), None)
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    # Bot retiré du serveur : ses entrées en cache ne serviront plus
+    _trial_channel_cache.pop(guild.id, None)
+    invalidate_player_caches(guild.id)
+    _forget_send_perms(guild.id)
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    # Permissions d'un rôle modifiées : les droits d'envoi du serveur sont à recalculer
+    if before.permissions != after.permissions:
+        _forget_send_perms(after.guild.id)
+
 # ---------- Autocomplete ----------
 async def autocomplete_external_names(interaction: discord.Interaction, current: str):
-    guild_id = interaction.guild_id
+    # Filtre en mémoire sur la liste en cache : aucune requête SQL par frappe
+    lowered, display = await get_external_names(interaction.guild_id)
+    prefix = current.strip().lower()
     results = []
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT name FROM players_external WHERE guild_id=? AND name LIKE ? LIMIT 25",
-            (guild_id, f"%{current}%")
-        ) as cur:
-            rows = await cur.fetchall()
-            results = [app_commands.Choice(name=r[0], value=r[0]) for r in rows]
+    # Les noms commençant par le préfixe forment une plage contiguë de la liste triée
+    for i in range(bisect_left(lowered, prefix), len(lowered)):
+        if not lowered[i].startswith(prefix) or len(results) == 25:
+            break
+        results.append(app_commands.Choice(name=display[i], value=display[i]))
     return results
 
 # ---------- Slash Commands (EXTERNAL ONLY) ----------
@@ -455,13 +770,12 @@ async def check_pseudo(interaction: discord.Interaction, pseudo: str):
 @app_commands.describe(name="Nom du joueur à ajouter")
 async def add_player(interaction: discord.Interaction, name: str):
     if interaction.guild is None:
-        await interaction.response.send_message("❌ À utiliser dans un serveur.", ephemeral=True)
+        await interaction.response.send_message(MSG_GUILD_ONLY, ephemeral=True)
         return
 
     created, msg = await add_player_by_name(interaction.guild.id, name)
     text = f"✅ **{name.strip()}** ajouté à la liste pour 14 jours." if created else f"⚠️ {msg}"
     await interaction.response.send_message(text)
-"Ajoute-le d'abord avec `/add name:<nom>`."
 
 @bot.tree.command(name="check", description="Vérifie la période d’essai d’une entrée par nom.")
 @app_commands.guilds(TEST_GUILD_ID)
@@ -471,14 +785,15 @@ async def add_player(interaction: discord.Interaction, name: str):
 async def check_external(interaction: discord.Interaction, name: str):
     name_display = name.strip()
     name_key = _normalize_name(name_display)
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT added_at_utc, trial_end_utc FROM players_external WHERE guild_id=? AND name_key=?",
-            (interaction.guild.id, name_key),
-        ) as cur:
-            row = await cur.fetchone()
+    # ACK immédiat : la lecture en base ne compte plus dans la fenêtre de 3 s
+    await interaction.response.defer(thinking=True)
+    async with bot.db.execute(
+        SQL_GET_TRIAL_EXTERNAL,
+        (interaction.guild.id, name_key),
+    ) as cur:
+        row = await cur.fetchone()
     if not row:
-        await interaction.response.send_message(f"ℹ️ **{name_display}** n'est pas dans la liste.")
+        await interaction.followup.send(f"ℹ️ **{name_display}** n'est pas dans la liste.")
         return
 
     added_at_utc = parse_iso(row[0])
@@ -491,18 +806,18 @@ async def check_external(interaction: discord.Interaction, name: str):
 
     if remaining.total_seconds() > 0:
         txt_remaining = humanize_timedelta(remaining)
-        await interaction.response.send_message(
+        await interaction.followup.send(
             f"👤 **{name_display}**\n"
-            f"- Ajouté il y a **{txt_since}** (UTC: {added_at_utc.strftime('%Y-%m-%d %H:%M')})\n"
-            f"- Fin d’essai dans **{txt_remaining}** (UTC: {trial_end_utc.strftime('%Y-%m-%d %H:%M')})\n"
+            f"- Ajouté il y a **{txt_since}** (UTC: {added_at_utc.strftime(TS_FMT)})\n"
+            f"- Fin d’essai dans **{txt_remaining}** (UTC: {trial_end_utc.strftime(TS_FMT)})\n"
             f"- Statut: {status}"
         )
     else:
         ended_for = humanize_timedelta(-remaining)
-        await interaction.response.send_message(
+        await interaction.followup.send(
             f"👤 **{name_display}**\n"
-            f"- Ajouté il y a **{txt_since}** (UTC: {added_at_utc.strftime('%Y-%m-%d %H:%M')})\n"
-            f"- Période d’essai terminée depuis **{ended_for}** (UTC: {trial_end_utc.strftime('%Y-%m-%d %H:%M')})\n"
+            f"- Ajouté il y a **{txt_since}** (UTC: {added_at_utc.strftime(TS_FMT)})\n"
+            f"- Période d’essai terminée depuis **{ended_for}** (UTC: {trial_end_utc.strftime(TS_FMT)})\n"
             f"- Statut: {status}"
         )
 
@@ -522,48 +837,43 @@ async def remove_entry(
     delete_notes: bool = True,
 ):
     if interaction.guild is None:
-        await interaction.response.send_message("❌ À utiliser dans un serveur.", ephemeral=True)
+        await interaction.response.send_message(MSG_GUILD_ONLY, ephemeral=True)
         return
 
     name_display = name.strip()
     name_key = _normalize_name(name_display)
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    db = bot.db
+    async with bot.db_lock:
         deleted_main = 0
         deleted_notes = 0
 
-        if notes_only:
-            before = db.total_changes
-            await db.execute(
-                "DELETE FROM player_notes_external WHERE guild_id=? AND name_key=?",
+        # Les DELETE ouvrent une transaction implicite : un seul commit (un seul fsync) pour les deux
+        if not notes_only:
+            async with db.execute(
+                SQL_DELETE_PLAYER_EXTERNAL,
                 (interaction.guild.id, name_key),
-            )
-            await db.commit()
-            deleted_notes = db.total_changes - before
-            if deleted_notes > 0:
-                await interaction.response.send_message(f"🗑️ Notes supprimées pour **{name_display}**.", ephemeral=True)
-            else:
-                await interaction.response.send_message(f"ℹ️ Aucune note à supprimer pour **{name_display}**.", ephemeral=True)
-            return
+            ) as cur:
+                deleted_main = cur.rowcount
+
+        if notes_only or delete_notes:
+            async with db.execute(
+                SQL_DELETE_NOTES_EXTERNAL,
+                (interaction.guild.id, name_key),
+            ) as cur:
+                deleted_notes = cur.rowcount
 
-        before = db.total_changes
-        await db.execute(
-            "DELETE FROM players_external WHERE guild_id=? AND name_key=?",
-            (interaction.guild.id, name_key),
-        )
         await db.commit()
-        deleted_main = db.total_changes - before
 
-        if delete_notes:
-            before = db.total_changes
-            await db.execute(
-                "DELETE FROM player_notes_external WHERE guild_id=? AND name_key=?",
-                (interaction.guild.id, name_key),
-            )
-            await db.commit()
-            deleted_notes = db.total_changes - before
+    if notes_only:
+        if deleted_notes > 0:
+            await interaction.response.send_message(MSG_NOTES_DELETED.format(name=name_display), ephemeral=True)
+        else:
+            await interaction.response.send_message(MSG_NO_NOTES.format(name=name_display), ephemeral=True)
+        return
 
     if deleted_main > 0:
+        invalidate_player_caches(interaction.guild.id)
         extra = f" (+{deleted_notes} note(s) supprimée(s))" if delete_notes and deleted_notes > 0 else ""
         await interaction.response.send_message(f"🗑️ **{name_display}** retiré de la liste{extra}.")
     else:
@@ -575,76 +885,104 @@ async def remove_entry(
 async def list_all(interaction: discord.Interaction):
     guild = interaction.guild
     if guild is None:
-        await interaction.response.send_message("Cette commande doit être utilisée dans un serveur.", ephemeral=True)
+        await interaction.response.send_message(MSG_GUILD_ONLY, ephemeral=True)
         return
 
-    ext_rows  = await fetch_all_external_players(guild.id)
-    en_essai_lines, termines_lines = [], []
-
-    for name, added_iso, end_iso in ext_rows:
-        display = f"**{name}**"
-        status, delta = _status_and_delta(added_iso, end_iso)
-        line = f"{display} — {status} — {delta}"
-        (en_essai_lines if "En essai" in status else termines_lines).append(line)
-
-    if not en_essai_lines and not termines_lines:
-        await interaction.response.send_message("Aucun inscrit dans la liste pour ce serveur.")
+    await interaction.response.defer(thinking=True)
+    # Un seul "maintenant" pour tout /list : durées SQL et horodatage de chaque page
+    cached = _list_cache.get(guild.id)
+    if cached and time.monotonic() - cached[0] < LIST_CACHE_TTL:
+        _, now_iso, total, in_trial, page_descriptions = cached
+    else:
+        now_iso = _now_iso()
+        total, in_trial = await count_external_players(guild.id, now_iso)
+        page_descriptions = {}
+        _list_cache[guild.id] = (time.monotonic(), now_iso, total, in_trial, page_descriptions)
+    now_utc = parse_iso(now_iso)
+    if total == 0:
+        await interaction.followup.send("Aucun inscrit dans la liste pour ce serveur.")
         return
 
-    def build_pages():
-        full_lines = []
-        if en_essai_lines:
-            full_lines.append("**🟡 En période d’essai**")
-            full_lines.extend(f"- {l}" for l in en_essai_lines)
-        if termines_lines:
-            if full_lines: full_lines.append("")
-            full_lines.append("**✅ Période d’essai terminée**")
-            full_lines.extend(f"- {l}" for l in termines_lines)
-
-        chunks = list(_chunk(full_lines, 20))
-        pages = []
-        total = len(chunks)
-        for i, chunk in enumerate(chunks, start=1):
-            embed = discord.Embed(
-                title=f"📋 Liste complète — {guild.name}",
-                description="\n".join(chunk),
-                color=discord.Color.teal(),
-                timestamp=datetime.now(timezone.utc)
+    async def render_page(index: int) -> discord.Embed:
+        description = page_descriptions.get(index)
+        if description is None:
+            # Seules les lignes de la page affichée sont lues en base (LIMIT/OFFSET) et formatées
+            rows = await fetch_external_players_page(
+                guild.id, now_iso, in_trial, index * LIST_PAGE_SIZE, LIST_PAGE_SIZE
             )
-            embed.set_footer(text=f"Page {i}/{total}")
-            pages.append(embed)
-        return pages
+            lines = []
+            section = None
+            for name, since_s, remaining_s, row_in_trial in rows:
+                if row_in_trial is not section:
+                    if lines: lines.append("")
+                    lines.append("**🟡 En période d’essai**" if row_in_trial else "**✅ Période d’essai terminée**")
+                    section = row_in_trial
+                status, delta = _status_and_delta(row_in_trial, since_s, remaining_s)
+                if len(name) > LIST_NAME_MAX:
+                    name = name[:LIST_NAME_MAX - 1] + "…"
+                lines.append(f"- **{name}** — {status} — {delta}")
+            description = page_descriptions[index] = "\n".join(lines)
+
+        embed = discord.Embed(
+            title=f"📋 Liste complète — {guild.name}",
+            description=description,
+            color=discord.Color.teal(),
+            timestamp=now_utc
+        )
+        embed.set_footer(text=f"Page {index + 1}/{page_count}")
+        return embed
+
+    page_count = (total + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+    if page_count == 1:
+        # Une seule page : pas de vue de pagination à enregistrer
+        await interaction.followup.send(embed=await render_page(0))
+        return
+    view = ListPaginator(page_count, render_page)
+    await interaction.followup.send(embed=await view.get_page(0), view=view)
 
-    pages = build_pages()
-    view = ListPaginator(pages)
-    await interaction.response.send_message(embed=pages[0], view=view)
+# Pagination au budget de caractères : autant de lignes que la description d'un embed
+# (4096) peut en tenir au pire, au lieu de 20 lignes fixes souvent très courtes.
+EMBED_DESC_LIMIT = 4096
+LIST_NAME_MAX = 32          # au-delà, le nom est tronqué dans /list
+LIST_LINE_OVERHEAD = 72     # "- **…** — statut — ajouté il y a …, terminé depuis …"
+LIST_HEADERS_BUDGET = 64    # deux titres de section + ligne vide
+LIST_PAGE_SIZE = (EMBED_DESC_LIMIT - LIST_HEADERS_BUDGET) // (LIST_NAME_MAX + LIST_LINE_OVERHEAD)
 
 class ListPaginator(discord.ui.View):
-    def __init__(self, pages: list[discord.Embed]):
+    # Pages construites à la demande par render_page(index), puis gardées en cache
+    def __init__(self, page_count: int, render_page: Callable[[int], Awaitable[discord.Embed]]):
         super().__init__(timeout=300)
-        self.pages = pages
+        self.page_count = page_count
+        self.render_page = render_page
+        self._cache: dict[int, discord.Embed] = {}
         self.index = 0
         self._sync_buttons_state()
 
     def _sync_buttons_state(self):
         self.prev_button.disabled = (self.index == 0)
-        self.next_button.disabled = (self.index >= len(self.pages) - 1)
+        self.next_button.disabled = (self.index >= self.page_count - 1)
+
+    async def get_page(self, index: int) -> discord.Embed:
+        embed = self._cache.get(index)
+        if embed is None:
+            embed = self._cache[index] = await self.render_page(index)
+        return embed
 
     @discord.ui.button(label="◀ Précédent", style=discord.ButtonStyle.secondary)
     async def prev_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         if self.index > 0:
             self.index -= 1
             self._sync_buttons_state()
-            await interaction.response.edit_message(embed=self.pages[self.index], view=self)
+            await interaction.response.edit_message(embed=await self.get_page(self.index), view=self)
         else:
             await interaction.response.defer()
 
     @discord.ui.button(label="Suivant ▶", style=discord.ButtonStyle.primary)
     async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.index < len(self.pages) - 1:
+        if self.index < self.page_count - 1:
             self.index += 1
             self._sync_buttons_state()
-            await interaction.response.edit_message(embed=self.pages[self.index], view=self)
+            await interaction.response.edit_message(embed=await self.get_page(self.index), view=self)
         else:
             await interaction.response.defer()
 
@@ -655,24 +993,24 @@ class ListPaginator(discord.ui.View):
 @lead_only()
 async def note_form(interaction: discord.Interaction, name: str):
     if interaction.guild is None:
-        await interaction.response.send_message("❌ À utiliser dans un serveur.", ephemeral=True)
+        await interaction.response.send_message(MSG_GUILD_ONLY, ephemeral=True)
         return
     # s’assurer que le nom existe
-    name_key = _normalize_name(name)
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT 1 FROM players_external WHERE guild_id=? AND name_key=?",
-            (interaction.guild.id, name_key),
-        ) as cur:
-            if not await cur.fetchone():
-                await interaction.response.send_message(
-                    "❌ Ce nom n'est pas dans la liste. Ajoute-le d'abord avec `/add name:<nom>`",
-                    ephemeral=True
-                )
-                return
-    view = NotesViewExternal(interaction.guild.id, name.strip())
+    name_display = name.strip()
+    name_key = _normalize_name(name_display)
+    async with bot.db.execute(
+        SQL_EXISTS_PLAYER_EXTERNAL,
+        (interaction.guild.id, name_key),
+    ) as cur:
+        if not await cur.fetchone():
+            await interaction.response.send_message(
+                MSG_NOT_LISTED,
+                ephemeral=True
+            )
+            return
+    view = NotesViewExternal(interaction.guild.id, name_display)
     await interaction.response.send_message(
-        f"📝 Formulaire de notes pour **{name.strip()}** — clique ci-dessous.",
+        f"📝 Formulaire de notes pour **{name_display}** — clique ci-dessous.",
         view=view, ephemeral=True
     )
 
@@ -682,30 +1020,36 @@ async def note_form(interaction: discord.Interaction, name: str):
 @app_commands.guilds(TEST_GUILD_ID)
 @lead_only()
 async def notes_show(interaction: discord.Interaction, name: str):
-    def val(x): return x if (x and str(x).strip()) else "—"
+    # Les formulaires enregistrent des valeurs déjà strip() : vide ou NULL suffit à tester
+    def val(x): return x or "—"
     name_display = name.strip()
     name_key = _normalize_name(name_display)
+    await interaction.response.defer(thinking=True)
     row = await get_notes_external(interaction.guild.id, name_key)
     if not row:
-        await interaction.response.send_message(f"ℹ️ Aucune note trouvée pour **{name_display}**.")
+        await interaction.followup.send(f"ℹ️ Aucune note trouvée pour **{name_display}**.")
         return
     (stored_name, characters_level, prev_guild_alliance, optimized, content_preference,
      objectives, age, contribution, updated_at_iso) = row
-    updated = parse_iso(updated_at_iso).strftime("%Y-%m-%d %H:%M UTC")
+    updated = parse_iso(updated_at_iso).strftime(TS_FMT) + " UTC"
+    # Une seule description plutôt que 7 champs : charge utile plus légère
+    # (somme des max_length des formulaires < 4096, limite d'une description)
     embed = discord.Embed(
         title=f"Notes — {stored_name}",
+        description="\n".join((
+            f"**Combien de perso / LVL** — {val(characters_level)}",
+            f"**Ancienne guilde / alliance** — {val(prev_guild_alliance)}",
+            f"**Opti ou pas** — {val(optimized)}",
+            f"**Préférence PvP / PvM** — {val(content_preference)}",
+            f"**Objectifs / projets** — {val(objectives)}",
+            f"**Âge (optionnel)** — {val(age)}",
+            f"**Apport à la guilde (optionnel)** — {val(contribution)}",
+        )),
         color=discord.Color.blue(),
         timestamp=datetime.now(timezone.utc)
     )
-    embed.add_field(name="Combien de perso / LVL", value=val(characters_level), inline=False)
-    embed.add_field(name="Ancienne guilde / alliance", value=val(prev_guild_alliance), inline=False)
-    embed.add_field(name="Opti ou pas", value=val(optimized), inline=False)
-    embed.add_field(name="Préférence PvP / PvM", value=val(content_preference), inline=False)
-    embed.add_field(name="Objectifs / projets", value=val(objectives), inline=False)
-    embed.add_field(name="Âge (optionnel)", value=val(age), inline=True)
-    embed.add_field(name="Apport à la guilde (optionnel)", value=val(contribution), inline=False)
     embed.set_footer(text=f"Dernière mise à jour: {updated}")
-    await interaction.response.send_message(embed=embed)
+    await interaction.followup.send(embed=embed)
 
 @bot.tree.command(name="delnotes", description="Supprime les notes (par nom).")
 @app_commands.describe(name="Nom texte (autocomplete)")
@@ -713,12 +1057,13 @@ async def notes_show(interaction: discord.Interaction, name: str):
 @app_commands.guilds(TEST_GUILD_ID)
 @lead_only()
 async def delnotes(interaction: discord.Interaction, name: str):
-    name_key = _normalize_name(name)
+    name_display = name.strip()
+    name_key = _normalize_name(name_display)
     changes = await delete_notes_external(interaction.guild.id, name_key)
     if changes > 0:
-        await interaction.response.send_message(f"🗑️ Notes supprimées pour **{name.strip()}**.")
+        await interaction.response.send_message(MSG_NOTES_DELETED.format(name=name_display))
     else:
-        await interaction.response.send_message(f"ℹ️ Aucune note à supprimer pour **{name.strip()}**.")
+        await interaction.response.send_message(MSG_NO_NOTES.format(name=name_display))
 
 @bot.tree.command(name="settrialchannel", description="Définit le salon des rappels J+14.")
 @app_commands.describe(channel="Salon des rappels (laisser vide pour le salon courant)")
@@ -726,7 +1071,7 @@ async def delnotes(interaction: discord.Interaction, name: str):
 @lead_only()
 async def set_trial_channel_cmd(interaction: discord.Interaction, channel: Optional[discord.TextChannel] = None):
     if interaction.guild is None:
-        await interaction.response.send_message("❌ À utiliser dans un serveur.", ephemeral=True)
+        await interaction.response.send_message(MSG_GUILD_ONLY, ephemeral=True)
         return
     target = channel or interaction.channel
     await set_trial_channel(interaction.guild.id, target.id)
@@ -735,51 +1080,148 @@ async def set_trial_channel_cmd(interaction: discord.Interaction, channel: Optio
 # ---------- Error handler ----------
 @bot.tree.error
 async def on_app_command_error(interaction: discord.Interaction, error: AppCommandError):
+    # Réponse initiale ou followup selon l'état, sans exception en guise de contrôle de flux
+    send = interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
     if isinstance(error, CheckFailure):
-        if interaction.response.is_done():
-            await interaction.followup.send("⛔ Commande réservée aux **Leads**.", ephemeral=True)
-        else:
-            await interaction.response.send_message("⛔ Commande réservée aux **Leads**.", ephemeral=True)
+        await send(MSG_LEAD_ONLY, ephemeral=True)
         return
-    # fallback générique
-    try:
-        await interaction.response.send_message("❌ Une erreur est survenue.", ephemeral=True)
-    except discord.InteractionResponded:
-        await interaction.followup.send("❌ Une erreur est survenue.", ephemeral=True)
+    # fallback générique : on trace l'erreur inattendue avant de répondre
+    cmd = interaction.command.qualified_name if interaction.command else "?"
+    logger.error("Erreur sur /%s", cmd, exc_info=error)
+    await send("❌ Une erreur est survenue.", ephemeral=True)
 
 # ---------- Rappels J+14 (EXTERNAL ONLY) ----------
-@tasks.loop(minutes=5.0)
+# Droit d'envoi du bot : (guild_id, channel_id) -> (autorisé, instant de calcul monotonic,
+# rôle le plus haut du bot à ce moment). Évite de recalculer les overwrites à chaque tick ;
+# invalidé par on_guild_channel_update / on_guild_role_update, ou si le bot a changé de
+# rôle principal.
+SEND_PERM_CACHE_TTL = 300.0
+_send_perm_cache: dict[tuple[int, int], tuple[bool, float, Optional[int]]] = {}
+
+def _forget_send_perms(guild_id: int):
+    for key in [k for k in _send_perm_cache if k[0] == guild_id]:
+        del _send_perm_cache[key]
+
+def _can_send(guild: discord.Guild, channel: discord.TextChannel) -> bool:
+    me = guild.me
+    top_role_id = me.top_role.id if me else None
+    key = (guild.id, channel.id)
+    cached = _send_perm_cache.get(key)
+    if cached and cached[2] == top_role_id and time.monotonic() - cached[1] < SEND_PERM_CACHE_TTL:
+        return cached[0]
+    allowed = channel.permissions_for(me).send_messages if me else False
+    _send_perm_cache[key] = (allowed, time.monotonic(), top_role_id)
+    return allowed
+
+# Envois de rappels en vol, tous serveurs confondus (les serveurs sont traités en parallèle)
+TRIAL_SEND_CONCURRENCY = 8
+_trial_send_sem = asyncio.Semaphore(TRIAL_SEND_CONCURRENCY)
+
+async def _reminder_channel(guild: discord.Guild) -> Optional[discord.TextChannel]:
+    # Salon des rappels utilisable, ou None (pas de salon, salon supprimé / non textuel, pas le droit)
+    channel_id = await get_trial_channel_id(guild.id)
+    if not channel_id:
+        return None
+    channel = guild.get_channel(channel_id)
+    if not isinstance(channel, discord.TextChannel) or not _can_send(guild, channel):
+        return None
+    return channel
+
+async def _process_guild(guild: discord.Guild, channel: discord.TextChannel, due_ext: list[tuple[str, str, str]]):
+    try:
+        notified_keys = []
+        # Envois concurrents mais bornés : discord.py gère le rate limit du salon,
+        # le sémaphore partagé évite juste d'empiler tous les lots d'un coup
+        async def notify(name: str, added_iso: str):
+            async with _trial_send_sem:
+                # added_at_utc est un ISO UTC : ses 10 premiers caractères sont déjà la date
+                await channel.send(MSG_TRIAL_REMINDER.format(name=name, date=added_iso[:10]))
+            notified_keys.append(_normalize_name(name))
+
+        try:
+            results = await asyncio.gather(
+                *(notify(name, added_iso) for name, added_iso, trial_end_iso in due_ext),
+                return_exceptions=True,
+            )
+        finally:
+            # Marque en une fois tout ce qui a été envoyé, même si des envois ont échoué
+            await mark_notified_external_bulk(guild.id, notified_keys)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("[trial_checker] Envoi échoué sur guild %s", guild.id, exc_info=result)
+    except Exception:
+        logger.exception("[trial_checker] Erreur sur guild %s", guild.id)
+
+# Réveil calé sur la prochaine échéance (plafonné) plutôt qu'un tick fixe de 5 minutes.
+# Un ajout tombe 14 jours plus tard : il ne peut pas précéder un réveil déjà planifié.
+TRIAL_CHECK_INTERVAL = 300.0    # cadence de base : rappels dus mais pas encore envoyés
+TRIAL_CHECK_MAX_DELAY = 3600.0  # plafond : rattrape les modifs faites hors du bot
+
+async def _next_check_delay() -> float:
+    try:
+        next_due = await get_next_due_external()
+    except Exception:
+        logger.exception("[trial_checker] Erreur de lecture de la prochaine échéance")
+        return TRIAL_CHECK_INTERVAL
+    if next_due is None:
+        return TRIAL_CHECK_MAX_DELAY
+    wait = (parse_iso(next_due) - datetime.now(timezone.utc)).total_seconds()
+    if wait <= 0:
+        # Rappels en attente sur un salon configuré (envoi échoué, salon supprimé ou sans droit) :
+        # on réessaie à la cadence de base. Les serveurs sans salon sont exclus de next_due.
+        return TRIAL_CHECK_INTERVAL
+    return min(wait + 1, TRIAL_CHECK_MAX_DELAY)
+
+@tasks.loop(seconds=TRIAL_CHECK_INTERVAL)
 async def trial_checker():
-    for guild in bot.guilds:
-        channel_id = await get_trial_channel_id(guild.id)
-        if not channel_id:
-            continue
-        channel = guild.get_channel(channel_id)
-        if not isinstance(channel, discord.TextChannel):
-            continue
-        perms_ok = channel.permissions_for(guild.me).send_messages if guild.me else False
-        if not perms_ok:
+    # Échéance relue à chaque réveil : voit aussi les lignes ajoutées / remises à zéro hors du bot
+    invalidate_next_due()
+    try:
+        due_by_guild = await fetch_due_trials_external_all()
+    except Exception:
+        logger.exception("[trial_checker] Erreur de lecture des rappels")
+        return
+    # Seuls les serveurs ayant un rappel dû et un salon utilisable sont visités, en parallèle :
+    # un salon lent ne retarde plus les autres
+    jobs = []
+    for guild_id, due_ext in due_by_guild.items():
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            # Bot retiré du serveur : rappels abandonnés, sinon relus à chaque tick
+            try:
+                await mark_notified_external_bulk(guild_id, [_normalize_name(name) for name, _, _ in due_ext])
+            except Exception:
+                logger.exception("[trial_checker] Erreur de marquage sur guild %s", guild_id)
             continue
-
         try:
-            due_ext = await fetch_due_trials_external(guild.id)
-            if due_ext:
-                for name, added_iso, trial_end_iso in due_ext:
-                    added_at = parse_iso(added_iso)
-                    await channel.send(
-                        f"🔔 **{name}** n'est plus en période d’essai "
-                        f"(14 jours écoulés depuis {added_at.strftime('%Y-%m-%d')})."
-                    )
-                    await mark_notified_external(guild.id, _normalize_name(name))
-        except Exception as e:
-            print(f"[trial_checker] Erreur sur guild {guild.id}: {e}")
+            channel = await _reminder_channel(guild)
+        except Exception:
+            logger.exception("[trial_checker] Erreur de lecture du salon sur guild %s", guild_id)
+            continue
+        if channel is not None:
+            jobs.append(_process_guild(guild, channel, due_ext))
+    if jobs:
+        await asyncio.gather(*jobs, return_exceptions=True)
+    trial_checker.change_interval(seconds=await _next_check_delay())
 
 @trial_checker.before_loop
 async def before_trial_checker():
     await bot.wait_until_ready()
 
+# ---------- Maintenance DB ----------
+DB_OPTIMIZE_INTERVAL = 24 * 3600.0
+
+@tasks.loop(seconds=DB_OPTIMIZE_INTERVAL)
+async def db_optimizer():
+    # Rafraîchit les statistiques du planificateur SQLite (ANALYZE si utile)
+    async with bot.db_lock:
+        await bot.db.execute(SQL_OPTIMIZE)
+
+@db_optimizer.before_loop
+async def before_db_optimizer():
+    # init_db vient de lancer PRAGMA optimize : premier passage un intervalle plus tard
+    await asyncio.sleep(DB_OPTIMIZE_INTERVAL)
+
 # ---------- Run ----------
 if __name__ == "__main__":
-    if os.getenv("PORT"):
-        start_keepalive_server()
     bot.run(TOKEN)
\ No newline at end of file